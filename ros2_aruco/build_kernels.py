@@ -0,0 +1,33 @@
+"""
+Ahead-of-time compilation of the ros2_aruco kernels with numba.pycc.
+
+setup.py builds the ros2_aruco.aruco_kernels extension from this module when
+numba is installed. Running this script directly writes the extension into
+the ros2_aruco source package instead, which is useful for development and
+symlink installs.
+"""
+
+import os
+
+from numba.pycc import CC
+
+from ros2_aruco.kernels import _rvecs_to_quats_loop
+
+# CC only accepts a plain module name; the package is added in
+# distutils_extension() and by the output directory below.
+cc = CC("aruco_kernels")
+cc.output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ros2_aruco")
+cc.verbose = True
+
+cc.export("rvecs_to_quats", "f8[:,:](f8[:,:])")(_rvecs_to_quats_loop)
+
+
+def distutils_extension():
+    """Return the extension to build, installed as ros2_aruco.aruco_kernels."""
+    ext = cc.distutils_extension()
+    ext.name = "ros2_aruco." + ext.name
+    return ext
+
+
+if __name__ == "__main__":
+    cc.compile()
@@ -14,7 +14,9 @@ def generate_launch_description():
     aruco_node = Node(
         package='ros2_aruco',
         executable='aruco_node',
-        parameters=[aruco_params]
+        parameters=[aruco_params],
+        # Skip the per-element type checks in generated message setters.
+        additional_env={'PYTHONOPTIMIZE': '1'}
     )
 
     return LaunchDescription([
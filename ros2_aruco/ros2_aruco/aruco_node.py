@@ -21,26 +21,61 @@ Parameters:
     image_topic - image topic to subscribe to (default /camera/image_raw)
     camera_info_topic - camera info topic to subscribe to
                          (default /camera/camera_info)
+    downscale_detection - detect markers on a half resolution image for
+                          frames of 720 rows or more; faster, but small or
+                          distant markers may be missed (default False)
 
 Author: Nathan Sprague
 Version: 10/26/2020
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import traceback
+
 import rclpy
 import rclpy.node
-from rclpy.qos import qos_profile_sensor_data
+from rclpy.qos import qos_profile_sensor_data, QoSHistoryPolicy, QoSProfile
 from cv_bridge import CvBridge
 import numpy as np
 import cv2
-import tf_transformations
 from sensor_msgs.msg import CameraInfo
 from sensor_msgs.msg import Image
 from geometry_msgs.msg import PoseArray, Pose
 from std_srvs.srv import Trigger
 from ros2_aruco_interfaces.msg import ArucoMarkers
+from ros2_aruco.kernels import rvecs_to_quats
 from rcl_interfaces.msg import ParameterDescriptor, ParameterType
 
+# Sensor data QoS (best effort) that only keeps the newest frame, so frames
+# are dropped rather than queued when detection can't keep up.
+IMAGE_QOS = QoSProfile(
+    history=QoSHistoryPolicy.KEEP_LAST,
+    depth=1,
+    reliability=qos_profile_sensor_data.reliability,
+    durability=qos_profile_sensor_data.durability,
+)
+
+# With downscale_detection, frames at least this tall are detected on a half
+# resolution image.
+PYRAMID_MIN_HEIGHT = 720
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+
+def marker_object_points(size):
+    """Corner coordinates of a square marker in the order IPPE_SQUARE expects."""
+    half = size / 2.0
+    return np.array(
+        [
+            [-half, half, 0.0],
+            [half, half, 0.0],
+            [half, -half, 0.0],
+            [-half, -half, 0.0],
+        ],
+        dtype=np.float32,
+    )
+
+
 class ArucoNode(rclpy.node.Node):
     def __init__(self):
         super().__init__("aruco_node")
@@ -91,6 +126,15 @@ class ArucoNode(rclpy.node.Node):
             ),
         )
 
+        self.declare_parameter(
+            name="downscale_detection",
+            value=False,
+            descriptor=ParameterDescriptor(
+                type=ParameterType.PARAMETER_BOOL,
+                description="Detect markers on a half resolution image for large frames.",
+            ),
+        )
+
         self.marker_size = (
             self.get_parameter("marker_size").get_parameter_value().double_value
         )
@@ -115,6 +159,10 @@ class ArucoNode(rclpy.node.Node):
             self.get_parameter("camera_frame").get_parameter_value().string_value
         )
 
+        self.downscale_detection = (
+            self.get_parameter("downscale_detection").get_parameter_value().bool_value
+        )
+
         # Make sure we have a valid dictionary id:
         try:
             dictionary_id = cv2.aruco.__getattribute__(dictionary_id_name)
@@ -140,6 +188,11 @@ class ArucoNode(rclpy.node.Node):
         # Default not active
         self.active = False
 
+        # Frames are processed off the executor thread; while a frame is in
+        # flight, newly arriving frames are dropped.
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._busy = False
+
         # Set up subscriptions
         # self.info_sub = self.create_subscription(
         #     CameraInfo, info_topic, self.info_callback, qos_profile_sensor_data
@@ -161,6 +214,10 @@ class ArucoNode(rclpy.node.Node):
         self.poses_pub = self.create_publisher(PoseArray, "aruco_poses", 10)
         self.markers_pub = self.create_publisher(ArucoMarkers, "aruco_markers", 10)
 
+        # Outgoing messages are reused between frames
+        self._pose_array = PoseArray()
+        self._markers = ArucoMarkers()
+
         # Set up fields for camera parameters
         self.info_msg = None
         self.intrinsic_mat = None
@@ -168,13 +225,41 @@ class ArucoNode(rclpy.node.Node):
 
         self.aruco_dictionary = cv2.aruco.getPredefinedDictionary(dictionary_id)
         self.aruco_parameters = cv2.aruco.DetectorParameters()
+        self.aruco_parameters.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_NONE
+        self.detector = cv2.aruco.ArucoDetector(
+            self.aruco_dictionary, self.aruco_parameters
+        )
         self.bridge = CvBridge()
 
+        # Working buffers: the gray frame is sized once camera info arrives,
+        # the pyramid buffer on the first downscaled detection.
+        self._gray = None
+        self._small_buf = None
+
+        # Object points only depend on the marker size, so build them once.
+        self._objp_cache = {
+            self.marker_size: marker_object_points(self.marker_size)
+        }
+        # If the kernel is JIT compiled, compile it now rather than on the first
+        # detection.
+        rvecs_to_quats(np.zeros((1, 3)))
+
     def info_callback(self, info_msg):
-        self.get_logger().info("INFO CB")
+        self.get_logger().debug("INFO CB")
         self.info_msg = info_msg
-        self.intrinsic_mat = np.reshape(np.array(self.info_msg.k), (3, 3))
-        self.distortion = np.array(self.info_msg.d)
+        # solvePnP expects CV_64F, C-contiguous arrays; anything else is
+        # silently converted on every call.
+        self.intrinsic_mat = np.ascontiguousarray(
+            self.info_msg.k, dtype=np.float64
+        ).reshape(3, 3)
+        self.distortion = np.ascontiguousarray(self.info_msg.d, dtype=np.float64)
+
+        # The output frame never changes, so set it on the reused messages once.
+        frame_id = self.camera_frame or info_msg.header.frame_id
+        self._markers.header.frame_id = frame_id
+        self._pose_array.header.frame_id = frame_id
+
+        self._gray = np.empty((info_msg.height, info_msg.width), dtype=np.uint8)
         # Assume that camera parameters will remain the same...
         self.destroy_subscription(self.info_sub)
 
@@ -183,60 +268,124 @@ class ArucoNode(rclpy.node.Node):
         # return
 
         if self.info_msg is None:
-            self.get_logger().warn("No camera info has been received!")
+            self.get_logger().warn(
+                "No camera info has been received!", throttle_duration_sec=1.0
+            )
             return
 
-        cv_image = self.bridge.imgmsg_to_cv2(img_msg, desired_encoding="mono8")
-        markers = ArucoMarkers()
-        pose_array = PoseArray()
-        if self.camera_frame == "":
-            markers.header.frame_id = self.info_msg.header.frame_id
-            pose_array.header.frame_id = self.info_msg.header.frame_id
-        else:
-            markers.header.frame_id = self.camera_frame
-            pose_array.header.frame_id = self.camera_frame
+        if self._busy:
+            return
+        self._busy = True
+        self._pool.submit(self._process_frame, img_msg).add_done_callback(
+            self._frame_done
+        )
+
+    def _frame_done(self, future):
+        self._busy = False
+        exc = future.exception()
+        if exc is not None:
+            self.get_logger().error(
+                "Frame processing failed:\n"
+                + "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+            )
 
+    def _process_frame(self, img_msg):
+        cv_image = self.image_to_gray(img_msg)
+        markers = self._markers
+        pose_array = self._pose_array
         markers.header.stamp = img_msg.header.stamp
         pose_array.header.stamp = img_msg.header.stamp
 
-        corners, marker_ids, rejected = cv2.aruco.detectMarkers(
-            cv_image, self.aruco_dictionary, parameters=self.aruco_parameters
-        )
+        corners, marker_ids = self.detect_markers(cv_image)
         # self.get_logger().info(f"corners: {corners}")
         # self.get_logger().info(f"marker_ids: {marker_ids}")
-        # self.get_logger().info(f"rejected: {rejected}")
         if marker_ids is not None:
             # self.get_logger().info("FOUND MARKER")
-            if cv2.__version__ > "4.0.0":
-                rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
-                    corners, self.marker_size, self.intrinsic_mat, self.distortion
-                )
-            else:
-                rvecs, tvecs = cv2.aruco.estimatePoseSingleMarkers(
-                    corners, self.marker_size, self.intrinsic_mat, self.distortion
+            # All markers share one size, so look everything up once.
+            num_markers = len(marker_ids)
+            objp = self._objp_cache[self.marker_size]
+            intrinsic_mat = self.intrinsic_mat
+            distortion = self.distortion
+            img_points = np.concatenate(corners).reshape(num_markers, 4, 2)
+            rvecs = np.empty((num_markers, 3))
+            tvecs = np.empty((num_markers, 3))
+            for i in range(num_markers):
+                _, rvec, tvec = cv2.solvePnP(
+                    objp,
+                    img_points[i],
+                    intrinsic_mat,
+                    distortion,
+                    flags=cv2.SOLVEPNP_IPPE_SQUARE,
                 )
-            for i, marker_id in enumerate(marker_ids):
+                rvecs[i] = rvec.ravel()
+                tvecs[i] = tvec.ravel()
+            quats = rvecs_to_quats(rvecs)
+
+            # Fill plain lists and assign them once, so the generated message
+            # setters only type check each field a single time.
+            poses = []
+            for i in range(num_markers):
                 pose = Pose()
-                pose.position.x = tvecs[i][0][0]
-                pose.position.y = tvecs[i][0][1]
-                pose.position.z = tvecs[i][0][2]
+                pose.position.x = tvecs[i, 0]
+                pose.position.y = tvecs[i, 1]
+                pose.position.z = tvecs[i, 2]
 
-                rot_matrix = np.eye(4)
-                rot_matrix[0:3, 0:3] = cv2.Rodrigues(np.array(rvecs[i][0]))[0]
-                quat = tf_transformations.quaternion_from_matrix(rot_matrix)
+                pose.orientation.x = quats[i, 0]
+                pose.orientation.y = quats[i, 1]
+                pose.orientation.z = quats[i, 2]
+                pose.orientation.w = quats[i, 3]
 
-                pose.orientation.x = quat[0]
-                pose.orientation.y = quat[1]
-                pose.orientation.z = quat[2]
-                pose.orientation.w = quat[3]
+                poses.append(pose)
 
-                pose_array.poses.append(pose)
-                markers.poses.append(pose)
-                markers.marker_ids.append(marker_id[0])
+            pose_array.poses = poses
+            markers.poses = poses
+            markers.marker_ids = marker_ids.ravel().tolist()
 
+            # Don't publish a frame that was still in flight when stop() was called.
+            if not self.active:
+                return
             self.poses_pub.publish(pose_array)
             self.markers_pub.publish(markers)
 
+    def detect_markers(self, cv_image):
+        """Detect markers, optionally using a half resolution pass for large frames."""
+        if not self.downscale_detection or cv_image.shape[0] < PYRAMID_MIN_HEIGHT:
+            corners, marker_ids, _ = self.detector.detectMarkers(cv_image)
+            return corners, marker_ids
+
+        small_shape = ((cv_image.shape[0] + 1) // 2, (cv_image.shape[1] + 1) // 2)
+        if self._small_buf is None or self._small_buf.shape != small_shape:
+            self._small_buf = np.empty(small_shape, dtype=np.uint8)
+        cv2.pyrDown(cv_image, dst=self._small_buf)
+        corners, marker_ids, _ = self.detector.detectMarkers(self._small_buf)
+        if marker_ids is None:
+            return corners, marker_ids
+
+        # Scale the corners back up and refine them on the full resolution image.
+        full_corners = np.concatenate(corners).reshape(-1, 1, 2) * 2.0
+        cv2.cornerSubPix(cv_image, full_corners, (5, 5), (-1, -1), SUBPIX_CRITERIA)
+        return full_corners.reshape(-1, 1, 4, 2), marker_ids
+
+    def image_to_gray(self, img_msg):
+        """Return a mono8 image for img_msg, avoiding CvBridge for raw 8-bit encodings."""
+        if img_msg.encoding not in ("mono8", "bgr8", "rgb8"):
+            return self.bridge.imgmsg_to_cv2(img_msg, desired_encoding="mono8")
+
+        # View the message buffer directly; rows may be padded up to img_msg.step.
+        rows = np.frombuffer(img_msg.data, dtype=np.uint8).reshape(
+            img_msg.height, img_msg.step
+        )
+        if img_msg.encoding == "mono8":
+            return rows[:, : img_msg.width]
+
+        color = rows[:, : img_msg.width * 3].reshape(img_msg.height, img_msg.width, 3)
+        gray = self._gray
+        if gray is not None and gray.shape != color.shape[:2]:
+            gray = None
+        if img_msg.encoding == "bgr8":
+            return cv2.cvtColor(color, cv2.COLOR_BGR2GRAY, dst=gray)
+        return cv2.cvtColor(color, cv2.COLOR_RGB2GRAY, dst=gray)
+
     def start_cb(self, request, response):
         response.success = self.start()
         return response
@@ -253,7 +402,7 @@ class ArucoNode(rclpy.node.Node):
             self.get_parameter("image_topic").get_parameter_value().string_value
         )
         self.img_sub = self.create_subscription(
-            Image, image_topic, self.image_callback, 10
+            Image, image_topic, self.image_callback, IMAGE_QOS
         )
         self.active = True
         return True
@@ -266,6 +415,10 @@ class ArucoNode(rclpy.node.Node):
             self.get_logger().info("ArucoNode: stop: img_sub destroyed")
         return True
 
+    def destroy_node(self):
+        self._pool.shutdown(wait=True)
+        super().destroy_node()
+
 # def main():
 #     rclpy.init()
 #     node = ArucoNode()
@@ -0,0 +1,58 @@
+"""
+Numerical kernels used by the Aruco node.
+
+numba is an optional dependency. When it is installed at build time the
+kernels are compiled ahead of time into the ros2_aruco.aruco_kernels
+extension (see build_kernels.py). Otherwise they are JIT compiled with numba
+if it is available at runtime, or equivalent NumPy versions are used.
+"""
+
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _rvecs_to_quats_loop(rvecs):
+    """Convert (N, 3) float64 rotation vectors to (N, 4) x, y, z, w quaternions."""
+    quats = np.empty((rvecs.shape[0], 4))
+    for i in range(rvecs.shape[0]):
+        rx = rvecs[i, 0]
+        ry = rvecs[i, 1]
+        rz = rvecs[i, 2]
+        theta = math.sqrt(rx * rx + ry * ry + rz * rz)
+        # sin(theta / 2) / theta tends to 1/2 as the rotation angle goes to zero.
+        if theta > 1e-8:
+            scale = math.sin(0.5 * theta) / theta
+        else:
+            scale = 0.5
+        quats[i, 0] = rx * scale
+        quats[i, 1] = ry * scale
+        quats[i, 2] = rz * scale
+        quats[i, 3] = math.cos(0.5 * theta)
+    return quats
+
+
+def _rvecs_to_quats_numpy(rvecs):
+    """Vectorized NumPy equivalent of _rvecs_to_quats_loop."""
+    theta = np.linalg.norm(rvecs, axis=1)
+    half = 0.5 * theta
+    scale = np.full_like(theta, 0.5)
+    np.divide(np.sin(half), theta, out=scale, where=theta > 1e-8)
+    quats = np.empty((rvecs.shape[0], 4))
+    quats[:, :3] = rvecs * scale[:, np.newaxis]
+    quats[:, 3] = np.cos(half)
+    return quats
+
+
+try:
+    from ros2_aruco.aruco_kernels import rvecs_to_quats
+except ImportError:
+    if njit is not None:
+        rvecs_to_quats = njit(cache=True, fastmath=True)(_rvecs_to_quats_loop)
+    else:
+        rvecs_to_quats = _rvecs_to_quats_numpy
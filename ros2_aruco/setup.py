@@ -4,6 +4,15 @@ from glob import glob
 
 package_name = 'ros2_aruco'
 
+# Compile the pose kernels ahead of time when numba is available
+ext_modules = []
+try:
+    from build_kernels import distutils_extension
+except ImportError:
+    pass
+else:
+    ext_modules.append(distutils_extension())
+
 setup(
     name=package_name,
     version='0.1.0',
@@ -15,6 +24,7 @@ setup(
         (os.path.join('share', package_name, 'launch'), glob('launch/*.launch.py')),
         (os.path.join('share', package_name, 'config'), glob('config/*.yaml'))
     ],
+    ext_modules=ext_modules,
     install_requires=['setuptools'],
     zip_safe=True,
     maintainer='Nathan Sprague',
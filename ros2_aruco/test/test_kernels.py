@@ -0,0 +1,129 @@
+"""Check that all rotation vector to quaternion kernels agree."""
+
+import math
+
+import numpy as np
+import pytest
+
+from ros2_aruco import kernels
+
+
+def rodrigues(rvec):
+    """Rotation matrix for a rotation vector (Rodrigues' formula)."""
+    theta = np.linalg.norm(rvec)
+    if theta < 1e-12:
+        return np.eye(3)
+    kx, ky, kz = rvec / theta
+    k = np.array([[0.0, -kz, ky], [kz, 0.0, -kx], [-ky, kx, 0.0]])
+    return np.eye(3) + math.sin(theta) * k + (1.0 - math.cos(theta)) * (k @ k)
+
+
+def quat_from_matrix(r):
+    """Reference x, y, z, w quaternion for a rotation matrix (Shepperd's method)."""
+    trace = r[0, 0] + r[1, 1] + r[2, 2]
+    if trace > 0.0:
+        s = 2.0 * math.sqrt(trace + 1.0)
+        q = [
+            (r[2, 1] - r[1, 2]) / s,
+            (r[0, 2] - r[2, 0]) / s,
+            (r[1, 0] - r[0, 1]) / s,
+            0.25 * s,
+        ]
+    elif r[0, 0] > r[1, 1] and r[0, 0] > r[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + r[0, 0] - r[1, 1] - r[2, 2])
+        q = [
+            0.25 * s,
+            (r[0, 1] + r[1, 0]) / s,
+            (r[0, 2] + r[2, 0]) / s,
+            (r[2, 1] - r[1, 2]) / s,
+        ]
+    elif r[1, 1] > r[2, 2]:
+        s = 2.0 * math.sqrt(1.0 + r[1, 1] - r[0, 0] - r[2, 2])
+        q = [
+            (r[0, 1] + r[1, 0]) / s,
+            0.25 * s,
+            (r[1, 2] + r[2, 1]) / s,
+            (r[0, 2] - r[2, 0]) / s,
+        ]
+    else:
+        s = 2.0 * math.sqrt(1.0 + r[2, 2] - r[0, 0] - r[1, 1])
+        q = [
+            (r[0, 2] + r[2, 0]) / s,
+            (r[1, 2] + r[2, 1]) / s,
+            0.25 * s,
+            (r[1, 0] - r[0, 1]) / s,
+        ]
+    return np.array(q)
+
+
+def reference_quats(rvecs):
+    return np.array([quat_from_matrix(rodrigues(rvec)) for rvec in rvecs])
+
+
+def assert_same_rotation(actual, expected):
+    # q and -q describe the same rotation.
+    signs = np.where(np.sum(actual * expected, axis=1) < 0.0, -1.0, 1.0)
+    np.testing.assert_allclose(actual, expected * signs[:, np.newaxis], atol=1e-9)
+
+
+def sample_rvecs():
+    rng = np.random.default_rng(0)
+    axes = rng.normal(size=(10, 3))
+    axes /= np.linalg.norm(axes, axis=1)[:, np.newaxis]
+    return np.vstack(
+        [
+            rng.uniform(-2.0, 2.0, size=(50, 3)),
+            # theta close to zero, including the small angle branch
+            np.zeros((1, 3)),
+            axes * 1e-10,
+            axes * 1e-6,
+            # theta close to pi
+            axes * math.pi,
+            axes * (math.pi - 1e-6),
+        ]
+    )
+
+
+IMPLEMENTATIONS = [
+    kernels._rvecs_to_quats_loop,
+    kernels._rvecs_to_quats_numpy,
+    kernels.rvecs_to_quats,
+]
+
+
+@pytest.mark.parametrize("rvecs_to_quats", IMPLEMENTATIONS)
+def test_matches_rotation_matrix_reference(rvecs_to_quats):
+    rvecs = sample_rvecs()
+    assert_same_rotation(rvecs_to_quats(rvecs), reference_quats(rvecs))
+
+
+@pytest.mark.parametrize(
+    "rvecs_to_quats", [kernels._rvecs_to_quats_loop, kernels.rvecs_to_quats]
+)
+def test_implementations_agree(rvecs_to_quats):
+    rvecs = sample_rvecs()
+    np.testing.assert_allclose(
+        rvecs_to_quats(rvecs), kernels._rvecs_to_quats_numpy(rvecs), atol=1e-12
+    )
+
+
+@pytest.mark.parametrize("rvecs_to_quats", IMPLEMENTATIONS)
+def test_component_order(rvecs_to_quats):
+    # A quarter turn about each axis; w is the last component.
+    half = math.sqrt(0.5)
+    rvecs = np.eye(3) * (math.pi / 2)
+    expected = np.array(
+        [
+            [half, 0.0, 0.0, half],
+            [0.0, half, 0.0, half],
+            [0.0, 0.0, half, half],
+        ]
+    )
+    np.testing.assert_allclose(rvecs_to_quats(rvecs), expected, atol=1e-12)
+
+
+@pytest.mark.parametrize("rvecs_to_quats", IMPLEMENTATIONS)
+def test_zero_rotation_is_identity(rvecs_to_quats):
+    np.testing.assert_allclose(
+        rvecs_to_quats(np.zeros((1, 3))), [[0.0, 0.0, 0.0, 1.0]], atol=0.0
+    )